@@ -11,66 +11,85 @@ from livekit.plugins import google
 from api import AssistantFnc
 from prompts import WELCOME_MESSAGE, INSTRUCTIONS, LOOKUP_VIN_MESSAGE
 from guardrails import GuardrailStatus
+from nhtsa_api import close_session
 from dotenv import load_dotenv
 import logging
 import asyncio
+import functools
+import time
 
 load_dotenv()
 logger = logging.getLogger("voice-agent")
 
-async def entrypoint(ctx: JobContext):
-    await ctx.connect(auto_subscribe=AutoSubscribe.SUBSCRIBE_ALL)
-    participant = await ctx.wait_for_participant()
+# The realtime model sometimes commits the same transcript twice in a row
+_DUPLICATE_TRANSCRIPT_WINDOW = 2.0
 
-    user_identifier = participant.identity or f"web-{participant.sid}"
-    display_name = participant.name or user_identifier
-    logger.info(f"User connected: {user_identifier}, display_name: {display_name}")
+_IMAGE_TAG = "[image]"
 
-    # Build personalized instructions with user's name
-    personalized_welcome = f"Hi {display_name}! {WELCOME_MESSAGE}"
-    personalized_instructions = f"""{INSTRUCTIONS}
 
-## GREETING:
-When starting the conversation, greet the user warmly by saying: "{personalized_welcome}"
-"""
+@functools.lru_cache(maxsize=None)
+def _tool_names(cls) -> tuple:
+    """Names of the function tools on a class; only depends on the class"""
+    return tuple(tool.__name__ for tool in llm.find_function_tools(cls))
 
-    model = google.realtime.RealtimeModel(
-        model="gemini-2.5-flash-native-audio-preview-12-2025", 
-        voice="Puck", 
-        temperature=0.4,
-        instructions=personalized_instructions,
+
+def _get_tools(fnc) -> list:
+    """Bind the cached tool names to this instance's methods"""
+    return [getattr(fnc, name) for name in _tool_names(type(fnc))]
+
+
+def find_profile(session: AgentSession, user_text: str):
+    session.conversation.item.create(
+        llm.ChatMessage(
+            role='system',
+            content=LOOKUP_VIN_MESSAGE.format(user_msg=user_text)
+        )
     )
+    session.response.create()
 
-    assistant_fnc = AssistantFnc()
-    # Initialize session management
-    session_id = assistant_fnc.set_session(user_identifier, identifier_type="web")
-    logger.info(f"Session initialized: {session_id}")
-    
-    # Log the welcome message
-    assistant_fnc.log_message("assistant", personalized_welcome)
-    
-    tools = llm.find_function_tools(assistant_fnc)
-    agent = Agent(
-        instructions=personalized_instructions,
-        tools=tools,
+
+def handle_query(session: AgentSession, user_text: str):
+    session.conversation.item.create(
+        llm.ChatMessage(
+            role='user',
+            content=user_text
+        )
     )
+    session.response.create()
 
-    session = AgentSession(llm=model)
-    await session.start(room=ctx.room, agent=agent)
-    logger.info("Session started")
 
-    @session.on('user_speech_committed')
-    def on_user_speech_committed(msg: llm.ChatMessage):        
-        logger.info(f"user_speech_committed fired, content={msg.content[:50] if msg.content else 'None'}...")
-            
-        if isinstance(msg.content, list):
-            msg.content = '\n'.join('[image]' if isinstance(x, llm.ChatImage) else x for x in msg.content)
+def make_speech_handler(session: AgentSession, assistant_fnc: AssistantFnc):
+    """Build the user_speech_committed handler for one connection"""
+    last_text = None
+    last_text_at = 0.0
 
-        user_text = msg.content if isinstance(msg.content, str) else str(msg.content)
-        
-        # Ignore empty/whitespace transcripts
-        if not user_text or not user_text.strip():
+    def on_user_speech_committed(msg: llm.ChatMessage):
+        nonlocal last_text, last_text_at
+
+        # Ignore empty/whitespace transcripts before doing any other work;
+        # VAD commits these between utterances
+        content = msg.content
+        if not content:
+            return
+
+        # Flatten into a local; msg belongs to livekit and isn't ours to mutate
+        if isinstance(content, list):
+            if any(isinstance(x, llm.ChatImage) for x in content):
+                user_text = '\n'.join(_IMAGE_TAG if isinstance(x, llm.ChatImage) else x for x in content)
+            else:
+                user_text = '\n'.join(content)
+        else:
+            user_text = content if isinstance(content, str) else str(content)
+        user_text = user_text.strip()
+        if not user_text:
+            return
+
+        now = time.monotonic()
+        if user_text == last_text and now - last_text_at < _DUPLICATE_TRANSCRIPT_WINDOW:
             return
+        last_text, last_text_at = user_text, now
+
+        logger.info("user_speech_committed fired, content=%.50s...", user_text)
 
         # Apply guardrails to user input
         guardrail_result = assistant_fnc.check_input(user_text)
@@ -80,7 +99,7 @@ When starting the conversation, greet the user warmly by saying: "{personalized_
         
         if guardrail_result.status == GuardrailStatus.BLOCKED:
             # Input is blocked - inject guardrail message
-            logger.warning(f"Input blocked by guardrails: {user_text[:50]}...")
+            logger.warning("Input blocked by guardrails: %.50s...", user_text)
             session.conversation.item.create(
                 llm.ChatMessage(
                     role='assistant',
@@ -92,7 +111,7 @@ When starting the conversation, greet the user warmly by saying: "{personalized_
             return
         
         if guardrail_result.status == GuardrailStatus.REDIRECTED:
-            logger.info(f"Input redirected by guardrails: {user_text[:50]}...")
+            logger.info("Input redirected by guardrails: %.50s...", user_text)
             session.conversation.item.create(
                 llm.ChatMessage(
                     role='assistant',
@@ -105,28 +124,62 @@ When starting the conversation, greet the user warmly by saying: "{personalized_
 
         # Input passed guardrails - proceed normally
         if assistant_fnc.has_car():
-            handle_query(msg)
+            handle_query(session, user_text)
         else:
-            find_profile(msg)
+            find_profile(session, user_text)
 
-    def find_profile(msg: llm.ChatMessage):
-        session.conversation.item.create(
-            llm.ChatMessage(
-                role='system',
-                content=LOOKUP_VIN_MESSAGE(msg)
-            )
-        )
-        session.response.create()
+    return on_user_speech_committed
 
-    def handle_query(msg: llm.ChatMessage):
-        session.conversation.item.create(
-            llm.ChatMessage(
-                role='user',
-                content=msg.content
-            )
-        )
-        session.response.create()
+
+async def entrypoint(ctx: JobContext):
+    await ctx.connect(auto_subscribe=AutoSubscribe.SUBSCRIBE_ALL)
+
+    # None of this depends on who joins, so get it done before waiting
+    assistant_fnc = AssistantFnc()
+    tools = _get_tools(assistant_fnc)
+    ctx.add_shutdown_callback(assistant_fnc.aclose)
+    ctx.add_shutdown_callback(close_session)
+
+    participant = await ctx.wait_for_participant()
+
+    user_identifier = participant.identity or f"web-{participant.sid}"
+    display_name = participant.name or user_identifier
+    logger.info("User connected: %s, display_name: %s", user_identifier, display_name)
+
+    # Build personalized instructions with user's name
+    personalized_welcome = f"Hi {display_name}! {WELCOME_MESSAGE}"
+    personalized_instructions = f"""{INSTRUCTIONS}
+
+## GREETING:
+When starting the conversation, greet the user warmly by saying: "{personalized_welcome}"
+"""
+
+    model = google.realtime.RealtimeModel(
+        model="gemini-2.5-flash-native-audio-preview-12-2025", 
+        voice="Puck", 
+        temperature=0.4,
+        instructions=personalized_instructions,
+    )
+
+    agent = Agent(
+        instructions=personalized_instructions,
+        tools=tools,
+    )
+
+    # Load the user's session from SQLite while the realtime session connects
+    session = AgentSession(llm=model)
+    session_id, _ = await asyncio.gather(
+        assistant_fnc.set_session(user_identifier, identifier_type="web"),
+        session.start(room=ctx.room, agent=agent),
+    )
+    logger.info("Session initialized: %s", session_id)
+    logger.info("Session started")
     
+    # Log the welcome message
+    assistant_fnc.log_message("assistant", personalized_welcome)
+
+    session.on('user_speech_committed', make_speech_handler(session, assistant_fnc))
+
     # Trigger welcome (returns SpeechHandle, non-blocking)
     logger.info("Triggering welcome reply...")
     session.generate_reply()
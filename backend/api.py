@@ -1,120 +1,262 @@
 from livekit.agents import llm
-import enum
+from dataclasses import dataclass
 from typing import Annotated, Optional
 import logging
-from db_driver import DatabaseDriver, SessionManager
-from guardrails import Guardrails, GuardrailStatus
-from nhtsa_api import NHTSAApi
+import asyncio
+import collections
+import functools
+import time
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+from db_driver import Car, DatabaseDriver, SessionManager
+from guardrails import GUARDRAILS, GuardrailStatus
+from nhtsa_api import NHTSAApi, VehicleInfo, set_persistent_cache
 
 logger = logging.getLogger("user-data")
 logger.setLevel(logging.INFO)
 
 DB = DatabaseDriver()
 
+# SQLite calls are blocking; run them here so the event loop keeps servicing
+# the realtime audio session. Bounded so DB work can't starve other threads.
+_DB_EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix="db")
 
-class CarDetails(enum.Enum):
-    VIN = "vin"
-    Make = "make"
-    Model = "model"
-    Year = "year"
-    Mileage = "mileage"
-    Owner = "owner"
+# Conversation log is buffered in memory and written behind, one transaction
+# per flush, so logging never waits on SQLite during the conversation
+_LOG_RING_SIZE = 200
+_LOG_FLUSH_INTERVAL = 10.0
+
+# Strips separators users (and transcription) put inside a spoken VIN
+_VIN_CLEAN_TABLE = str.maketrans("", "", " -_\t\n\r")
+VIN_LENGTH = 17
+
+
+def _recall_key(year: int, make: str, model: str) -> tuple:
+    return (year, make.lower(), model.lower())
+
+
+async def _run_db(fn, *args):
+    """Run a blocking DB / session call on the DB thread pool"""
+    return await asyncio.get_running_loop().run_in_executor(_DB_EXECUTOR, fn, *args)
+
+
+# NHTSA's persistent cache lives in the same database; keep its SQLite calls
+# on the same bounded executor
+set_persistent_cache(DB, _run_db)
+
+
+async def _find_vehicle(vin: str) -> tuple[Optional[Car], Optional[VehicleInfo]]:
+    """The car on file for a VIN, or failing that its NHTSA decode.
+    
+    On a car-cache miss the NHTSA decode is started alongside the DB read so
+    an unknown VIN costs max(DB, NHTSA), not the sum; the decode is cancelled
+    if the DB has the car.
+    """
+    car = DB.get_cached_car(vin)
+    if car:
+        return car, None
+    
+    nhtsa_task = asyncio.create_task(NHTSAApi.decode_vin(vin))
+    try:
+        car = await _run_db(DB.get_car_by_vin, vin)
+    except BaseException:
+        nhtsa_task.cancel()
+        raise
+    if car:
+        nhtsa_task.cancel()
+        return car, None
+    return None, await nhtsa_task
+
+
+def timed_tool(fn):
+    """Log the wall-clock latency of an async tool call"""
+    @functools.wraps(fn)
+    async def wrapper(self, *args, **kwargs):
+        start = time.perf_counter_ns()
+        try:
+            return await fn(self, *args, **kwargs)
+        finally:
+            logger.info("tool=%s latency_ms=%.2f", fn.__name__, (time.perf_counter_ns() - start) / 1e6)
+    return wrapper
+
+
+@dataclass(slots=True)
+class CarState:
+    """The vehicle currently loaded for the conversation"""
+    vin: str = ""
+    make: str = ""
+    model: str = ""
+    year: int = 0
+    mileage: int = 0
+    owner: str = ""
 
 
 class AssistantFnc:
     def __init__(self):
-        self._car_details = {
-            CarDetails.VIN: "",
-            CarDetails.Make: "",
-            CarDetails.Model: "",
-            CarDetails.Year: "",
-            CarDetails.Mileage: 0,
-            CarDetails.Owner: ""
-        }
+        self._car = CarState()
+        self._car_str: Optional[str] = None
         self._session_id: Optional[str] = None
         self._session_manager = SessionManager()
-        self._guardrails = Guardrails()
         # Cache for pending vehicle info from NHTSA decode
         self._pending_vehicle = None
+        self._log_ring: collections.deque = collections.deque(maxlen=_LOG_RING_SIZE)
+        self._log_lock = asyncio.Lock()
+        self._log_flush_task = asyncio.create_task(self._periodic_flush(_LOG_FLUSH_INTERVAL))
+        # Background recall fetches started as soon as a vehicle is identified
+        self._recall_prefetch: dict[tuple, asyncio.Task] = {}
+        # Tool work in flight, so identical concurrent calls share one result
+        self._inflight: dict[tuple, asyncio.Task] = {}
     
-    def set_session(self, user_identifier: str, identifier_type: str = "web"):
+    async def set_session(self, user_identifier: str, identifier_type: str = "web"):
         """Initialize or resume a session for the user"""
-        self._session_id = self._session_manager.create_session(user_identifier, identifier_type)
+        self._session_id = await _run_db(self._session_manager.create_session, user_identifier, identifier_type)
         
         # Load existing vehicle if session has one
-        session = self._session_manager.get_session(self._session_id)
+        session = await _run_db(self._session_manager.get_session, self._session_id)
         if session and session.get("vehicle_vin"):
-            car = DB.get_car_by_vin(session["vehicle_vin"])
+            car = await _run_db(DB.get_car_by_vin, session["vehicle_vin"])
             if car:
-                self._car_details = {
-                    CarDetails.VIN: car.vin,
-                    CarDetails.Make: car.make,
-                    CarDetails.Model: car.model,
-                    CarDetails.Year: car.year,
-                    CarDetails.Mileage: car.mileage,
-                    CarDetails.Owner: car.owner_name
-                }
+                self._set_car(car)
         return self._session_id
     
     def log_message(self, role: str, content: str, metadata: dict = None):
-        """Log a message to conversation history"""
+        """Buffer a message for the conversation history (non-blocking)"""
         if self._session_id:
-            self._session_manager.add_message(self._session_id, role, content, metadata)
+            # Same format as SQLite's CURRENT_TIMESTAMP, taken now rather than at flush
+            timestamp = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+            if len(self._log_ring) == self._log_ring.maxlen:
+                logger.warning("Conversation log buffer full, dropping oldest message")
+            self._log_ring.append((role, content, metadata, timestamp))
+    
+    async def _flush_log(self):
+        """Write all buffered log messages in one transaction"""
+        async with self._log_lock:
+            if not self._log_ring:
+                return
+            batch = list(self._log_ring)
+            self._log_ring.clear()
+            try:
+                await _run_db(self._session_manager.add_messages_batch, self._session_id, batch)
+            except Exception as e:
+                logger.error("Error writing conversation log: %s", e, exc_info=True)
+                # Keep the batch for the next flush, ahead of anything logged since
+                overflow = len(self._log_ring) + len(batch) - self._log_ring.maxlen
+                if overflow > 0:
+                    logger.warning("Conversation log buffer full, dropping %d newest messages", overflow)
+                self._log_ring.extendleft(reversed(batch))
+    
+    async def _periodic_flush(self, interval: float):
+        """Flush the log buffer every `interval` seconds until cancelled"""
+        while True:
+            await asyncio.sleep(interval)
+            await self._flush_log()
     
-    def get_conversation_history(self, limit: int = 10) -> list:
+    async def aclose(self):
+        """Stop the periodic flush and write whatever is still buffered"""
+        self._log_flush_task.cancel()
+        for task in list(self._recall_prefetch.values()):
+            task.cancel()
+        await self._flush_log()
+    
+    async def get_conversation_history(self, limit: int = 10) -> list:
         """Get recent conversation history"""
         if self._session_id:
-            return self._session_manager.get_conversation_history(self._session_id, limit)
+            await self._flush_log()
+            return await _run_db(self._session_manager.get_conversation_history, self._session_id, limit)
         return []
     
     def check_input(self, user_input: str):
         """Check user input against guardrails"""
-        return self._guardrails.check_input(user_input)
+        return GUARDRAILS.check_input(user_input)
     
     def filter_output(self, response: str) -> str:
         """Filter AI response through guardrails"""
-        return self._guardrails.filter_output(response)
+        return GUARDRAILS.filter_output(response)
+    
+    @staticmethod
+    def _clean_vin(vin: str) -> str:
+        return vin.upper().translate(_VIN_CLEAN_TABLE)
+    
+    def _set_car(self, car: Car):
+        self._car = CarState(
+            vin=car.vin,
+            make=car.make,
+            model=car.model,
+            year=car.year,
+            mileage=car.mileage,
+            owner=car.owner_name
+        )
+        self._car_str = None
+        self._prefetch_recalls(car.year, car.make, car.model)
     
+    def _prefetch_recalls(self, year: int, make: str, model: str):
+        """Fetch recalls in the background while the conversation continues,
+        so a following check_recalls doesn't wait on NHTSA"""
+        key = _recall_key(year, make, model)
+        if key in self._recall_prefetch or NHTSAApi.has_cached_recalls(make, model, year):
+            return
+        task = asyncio.create_task(NHTSAApi.get_recalls_by_vehicle(make, model, year))
+        task.add_done_callback(lambda _: self._recall_prefetch.pop(key, None))
+        self._recall_prefetch[key] = task
+
+    async def _coalesce(self, key: tuple, factory):
+        """Run factory() once per key at a time; concurrent callers await the
+        same task instead of repeating the DB / NHTSA work"""
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(factory())
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+            self._inflight[key] = task
+        return await asyncio.shield(task)
+
     def get_car_str(self):
-        car_str = ""
-        for key, value in self._car_details.items():
-            if value:
-                car_str += f"{key.value}: {value}\n"
-        return car_str
+        if self._car_str is None:
+            c = self._car
+            parts = []
+            if c.vin:
+                parts.append(f"vin: {c.vin}\n")
+            if c.make:
+                parts.append(f"make: {c.make}\n")
+            if c.model:
+                parts.append(f"model: {c.model}\n")
+            if c.year:
+                parts.append(f"year: {c.year}\n")
+            if c.mileage:
+                parts.append(f"mileage: {c.mileage}\n")
+            if c.owner:
+                parts.append(f"owner: {c.owner}\n")
+            self._car_str = "".join(parts)
+        return self._car_str
     
     @llm.function_tool(description="lookup a car by its vin")
+    @timed_tool
     async def lookup_car(self, vin: Annotated[str, "The vin of the car to lookup"]):
         logger.info("lookup car - vin: %s", vin)
         
-        # Clean VIN
-        vin = vin.upper().replace(" ", "").replace("-", "")
+        vin = self._clean_vin(vin)
+        if len(vin) != VIN_LENGTH:
+            return "I couldn't find that VIN. Please double-check the number. It should be 17 characters."
         
-        # First check local database
-        result = DB.get_car_by_vin(vin)
+        return await self._coalesce(("lookup", vin), lambda: self._lookup_car(vin))
+    
+    async def _lookup_car(self, vin: str) -> str:
+        # Local database first, NHTSA decode if the VIN isn't on file
+        result, vehicle_info = await _find_vehicle(vin)
         
         if result:
-            self._car_details = {
-                CarDetails.VIN: result.vin,
-                CarDetails.Make: result.make,
-                CarDetails.Model: result.model,
-                CarDetails.Year: result.year,
-                CarDetails.Mileage: result.mileage,
-                CarDetails.Owner: result.owner_name
-            }
+            self._set_car(result)
             
             # Clear any pending vehicle
             self._pending_vehicle = None
             
             # Link to session
             if self._session_id:
-                self._session_manager.link_vehicle_to_session(self._session_id, vin)
+                await _run_db(self._session_manager.link_vehicle_to_session, self._session_id, vin)
             
             logger.info("Successfully looked up car: %s", result)
             return f"Found your {result.year} {result.make} {result.model}. Registered to {result.owner_name}. Current mileage: {result.mileage} miles."
         
-        # If not in database, try NHTSA to decode VIN
-        vehicle_info = await NHTSAApi.decode_vin(vin)
-        
+        # If not in database, use the NHTSA decode
         if vehicle_info:
             # Cache the decoded info for later use in create_car
             self._pending_vehicle = {
@@ -123,6 +265,7 @@ class AssistantFnc:
                 "model": vehicle_info.model,
                 "year": vehicle_info.year
             }
+            self._prefetch_recalls(vehicle_info.year, vehicle_info.make, vehicle_info.model)
             logger.info("VIN decoded via NHTSA: %s %s %s (cached for profile creation)", vehicle_info.year, vehicle_info.make, vehicle_info.model)
             return f"I found a {vehicle_info.year} {vehicle_info.make} {vehicle_info.model} but it's not in our system yet. Would you like me to create a profile for this vehicle? I'll need your name and current mileage."
         
@@ -130,40 +273,68 @@ class AssistantFnc:
         return "I couldn't find that VIN. Please double-check the number. It should be 17 characters."
     
     @llm.function_tool(description="Check for safety recalls on a vehicle using NHTSA data")
+    @timed_tool
     async def check_recalls(
         self, 
         vin: Annotated[str, "The VIN of the vehicle to check for recalls. If not provided, uses the current vehicle."] = None
     ):
         """Check NHTSA recalls for a vehicle"""
-        target_vin = vin or self._car_details.get(CarDetails.VIN)
+        target_vin = vin or self._car.vin
         
         if not target_vin:
             return "I need a VIN to check for recalls. Could you provide your vehicle's VIN number?"
         
-        # Clean VIN
-        target_vin = target_vin.upper().replace(" ", "").replace("-", "")
+        target_vin = self._clean_vin(target_vin)
+        if len(target_vin) != VIN_LENGTH:
+            return "That VIN doesn't look right. It should be 17 characters. Could you repeat it?"
         logger.info("Checking recalls for VIN: %s", target_vin)
         
-        vehicle_info, recalls = await NHTSAApi.get_recalls_by_vin(target_vin)
-        
-        if not vehicle_info:
+        return await self._coalesce(("recalls", target_vin), lambda: self._check_recalls(target_vin))
+    
+    async def _check_recalls(self, target_vin: str) -> str:
+        vehicle = await self._resolve_vehicle(target_vin)
+        if not vehicle:
             return "I couldn't decode that VIN. Please verify it's correct."
+        year, make, model = vehicle
+        
+        # Reuse the prefetch started when the vehicle was identified, if any
+        prefetch = self._recall_prefetch.get(_recall_key(year, make, model))
+        if prefetch:
+            recalls = await asyncio.shield(prefetch)
+        else:
+            recalls = await NHTSAApi.get_recalls_by_vehicle(make, model, year)
         
-        response = f"For your {vehicle_info.year} {vehicle_info.make} {vehicle_info.model}: "
+        response = f"For your {year} {make} {model}: "
         response += NHTSAApi.format_recalls_for_speech(recalls)
         
         # Log this check in session
-        if self._session_id:
-            self._session_manager.add_message(
-                self._session_id, 
-                "system", 
-                f"Recall check performed. Found {len(recalls)} recalls.",
-                {"vin": target_vin, "recall_count": len(recalls)}
-            )
+        self.log_message(
+            "system", 
+            f"Recall check performed. Found {len(recalls)} recalls.",
+            {"vin": target_vin, "recall_count": len(recalls)}
+        )
         
         return response
     
+    async def _resolve_vehicle(self, vin: str) -> Optional[tuple]:
+        """(year, make, model) for a VIN, preferring what is already known locally"""
+        if self.has_car() and vin == self._car.vin:
+            # The loaded car already has year/make/model, skip the VIN decode
+            return self._car.year, self._car.make, self._car.model
+        
+        pending = self._pending_vehicle
+        if pending and pending["vin"] == vin:
+            return pending["year"], pending["make"], pending["model"]
+        
+        car, vehicle_info = await _find_vehicle(vin)
+        if car:
+            return car.year, car.make, car.model
+        if not vehicle_info:
+            return None
+        return vehicle_info.year, vehicle_info.make, vehicle_info.model
+    
     @llm.function_tool(description="Get the details of the current car")
+    @timed_tool
     async def get_car_details(self):
         logger.info("get car details")
         if not self.has_car():
@@ -171,6 +342,7 @@ class AssistantFnc:
         return f"The car details are: {self.get_car_str()}"
     
     @llm.function_tool(description="Create a new car profile in the system. If the VIN was just looked up, vehicle details are auto-filled. Always ask for owner_name and mileage before calling this.")
+    @timed_tool
     async def create_car(
         self, 
         owner_name: Annotated[str, "The name of the vehicle owner - REQUIRED, must ask user"],
@@ -198,27 +370,21 @@ class AssistantFnc:
         logger.info("create car - vin: %s, make: %s, model: %s, year: %s, owner: %s, mileage: %s", 
                     vin, make, model, year, owner_name, mileage)
         
-        # Clean VIN
-        vin = vin.upper().replace(" ", "").replace("-", "")
+        vin = self._clean_vin(vin)
+        if len(vin) != VIN_LENGTH:
+            return "That VIN doesn't look right. It should be 17 characters. Could you repeat it?"
         
         try:
-            result = DB.create_car(vin, make, model, year, mileage, owner_name, owner_phone)
+            result = await _run_db(DB.create_car, vin, make, model, year, mileage, owner_name, owner_phone)
             
-            self._car_details = {
-                CarDetails.VIN: result.vin,
-                CarDetails.Make: result.make,
-                CarDetails.Model: result.model,
-                CarDetails.Year: result.year,
-                CarDetails.Mileage: result.mileage,
-                CarDetails.Owner: result.owner_name
-            }
+            self._set_car(result)
             
             # Clear pending vehicle
             self._pending_vehicle = None
             
             # Link to session
             if self._session_id:
-                self._session_manager.link_vehicle_to_session(self._session_id, vin)
+                await _run_db(self._session_manager.link_vehicle_to_session, self._session_id, vin)
             
             logger.info("Successfully created car: %s", result)
             return f"I've created a profile for your {year} {make} {model}, registered to {owner_name} with {mileage:,} miles. How can I help you today?"
@@ -227,6 +393,7 @@ class AssistantFnc:
             return f"There was an issue creating the vehicle profile. The VIN might already exist in our system."
     
     @llm.function_tool(description="Update the mileage for the current vehicle")
+    @timed_tool
     async def update_mileage(
         self, 
         mileage: Annotated[int, "The new mileage reading"]
@@ -235,13 +402,14 @@ class AssistantFnc:
         if not self.has_car():
             return "I need to look up your vehicle first. What's your VIN?"
         
-        vin = self._car_details[CarDetails.VIN]
-        success = DB.update_mileage(vin, mileage)
+        vin = self._car.vin
+        success = await _run_db(DB.update_mileage, vin, mileage)
         
         if success:
-            self._car_details[CarDetails.Mileage] = mileage
+            self._car.mileage = mileage
+            self._car_str = None
             return f"I've updated your mileage to {mileage:,} miles."
         return "There was an issue updating the mileage."
         
     def has_car(self):
-        return self._car_details[CarDetails.VIN] != ""
\ No newline at end of file
+        return bool(self._car.vin)
\ No newline at end of file
@@ -2,9 +2,142 @@ import sqlite3
 from typing import Optional
 from dataclasses import dataclass
 from contextlib import contextmanager
-from datetime import datetime
-import json
+import queue
+import threading
+import time
 import uuid
+import zlib
+
+import orjson
+from cachetools import LRUCache, TTLCache
+
+
+# Hot-path statements live in module constants so the text is identical on
+# every call and hits the connection's prepared-statement cache
+SQL_GET_CAR = "SELECT vin, make, model, year, mileage, owner_name, owner_phone FROM cars WHERE vin = ?"
+SQL_CREATE_CAR = """INSERT INTO cars (vin, make, model, year, mileage, owner_name, owner_phone) 
+                   VALUES (?, ?, ?, ?, ?, ?, ?)"""
+SQL_UPDATE_MILEAGE = "UPDATE cars SET mileage = ?, updated_at = CURRENT_TIMESTAMP WHERE vin = ?"
+
+SQL_FIND_SESSION = """SELECT session_id FROM sessions 
+                     WHERE user_identifier = ? AND identifier_type = ?
+                     ORDER BY last_active DESC LIMIT 1"""
+SQL_TOUCH_SESSION = "UPDATE sessions SET last_active = CURRENT_TIMESTAMP WHERE session_id = ?"
+SQL_CREATE_SESSION = "INSERT INTO sessions (session_id, user_identifier, identifier_type) VALUES (?, ?, ?)"
+SQL_GET_SESSION = """SELECT session_id, user_identifier, identifier_type, vehicle_vin, 
+                            created_at, last_active, metadata
+                     FROM sessions WHERE session_id = ?"""
+SQL_LINK_VEHICLE = "UPDATE sessions SET vehicle_vin = ?, last_active = CURRENT_TIMESTAMP WHERE session_id = ?"
+SQL_ADD_MESSAGE = "INSERT INTO conversation_history (session_id, role, content, metadata) VALUES (?, ?, ?, ?)"
+SQL_ADD_MESSAGE_AT = """INSERT INTO conversation_history (session_id, role, content, metadata, timestamp)
+                       VALUES (?, ?, ?, ?, ?)"""
+# Latest `limit` messages, returned oldest first. id breaks ties between
+# messages logged within the same second.
+SQL_GET_HISTORY = """SELECT role, content, timestamp, metadata FROM (
+                         SELECT id, role, content, timestamp, metadata
+                         FROM conversation_history
+                         WHERE session_id = ?
+                         ORDER BY timestamp DESC, id DESC
+                         LIMIT ?
+                     ) ORDER BY timestamp, id"""
+
+SQL_GET_NHTSA_CACHE = "SELECT payload, fetched_at FROM nhtsa_cache WHERE key = ? AND fetched_at > ?"
+SQL_SET_NHTSA_CACHE = "INSERT OR REPLACE INTO nhtsa_cache (key, payload, fetched_at) VALUES (?, ?, ?)"
+SQL_PRUNE_NHTSA_CACHE = "DELETE FROM nhtsa_cache WHERE fetched_at < ?"
+
+# Longest TTL nhtsa_api asks for (VIN decodes); older rows are never read
+# again and are dropped at startup
+NHTSA_CACHE_MAX_AGE = 86400
+
+# Per-connection prepared-statement cache; sized well above the number of
+# distinct statements above
+STATEMENT_CACHE_SIZE = 256
+
+# Read-through caches in front of the by-id lookups. Cars are invalidated on
+# every write; sessions only change vehicle_vin through link_vehicle_to_session
+# and a few seconds of stale last_active is harmless.
+CAR_CACHE_SIZE = 256
+SESSION_CACHE_SIZE = 1024
+SESSION_CACHE_TTL = 30
+
+# Applied to every connection. journal_mode=WAL is persistent in the file,
+# so it is set once in _init_db instead.
+CONNECTION_PRAGMAS = (
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=30000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-20000",
+    "PRAGMA mmap_size=268435456",
+)
+
+
+def _connect(db_path: str, **kwargs) -> sqlite3.Connection:
+    """Open a connection with the tuned per-connection pragmas"""
+    conn = sqlite3.connect(db_path, **kwargs)
+    for pragma in CONNECTION_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+class _ConnectionPool:
+    """Long-lived autocommit connections shared by everything using one db file"""
+    
+    def __init__(self, db_path: str, size: int = 4):
+        self.db_path = db_path
+        # Every connection to ':memory:' is a separate database, so share one
+        self._size = 1 if db_path == ":memory:" else size
+        self._idle: queue.LifoQueue = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+    
+    def _acquire(self) -> sqlite3.Connection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self._size:
+                self._created += 1
+                return _connect(
+                    self.db_path, cached_statements=STATEMENT_CACHE_SIZE, isolation_level=None, check_same_thread=False
+                )
+        # Pool exhausted, wait for a connection to be released
+        return self._idle.get()
+    
+    @contextmanager
+    def connection(self):
+        conn = self._acquire()
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            self._idle.put(conn)
+    
+    @contextmanager
+    def transaction(self):
+        """A pooled connection inside BEGIN IMMEDIATE ... COMMIT"""
+        with self.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            yield conn
+            conn.commit()
+
+
+_POOLS: dict[str, _ConnectionPool] = {}
+_POOLS_LOCK = threading.Lock()
+
+
+def _get_pool(db_path: str) -> _ConnectionPool:
+    with _POOLS_LOCK:
+        pool = _POOLS.get(db_path)
+        if pool is None:
+            pool = _POOLS[db_path] = _ConnectionPool(db_path)
+        return pool
+
+
+# Shared by every SessionManager, keyed by (db_path, session_id)
+_SESSION_CACHE: TTLCache = TTLCache(maxsize=SESSION_CACHE_SIZE, ttl=SESSION_CACHE_TTL)
+_SESSION_CACHE_LOCK = threading.Lock()
 
 
 @dataclass
@@ -18,23 +151,65 @@ class Car:
     owner_phone: str = ""
 
 
+# Row factories, set per cursor so results come back in their final shape
+def _car_row(cursor, row) -> Car:
+    return Car(
+        vin=row[0],
+        make=row[1],
+        model=row[2],
+        year=row[3],
+        mileage=row[4] or 0,
+        owner_name=row[5] or "",
+        owner_phone=row[6] or ""
+    )
+
+
+def _session_row(cursor, row) -> dict:
+    return {
+        "session_id": row[0],
+        "user_identifier": row[1],
+        "identifier_type": row[2],
+        "vehicle_vin": row[3],
+        "created_at": row[4],
+        "last_active": row[5],
+        "metadata": orjson.loads(row[6]) if row[6] else {}
+    }
+
+
+def _history_row(cursor, row) -> dict:
+    return {
+        "role": row[0],
+        "content": row[1],
+        "timestamp": row[2],
+        "metadata": orjson.loads(row[3]) if row[3] else {}
+    }
+
+
 class DatabaseDriver:
     def __init__(self, db_path: str = 'auto_db.sqlite'):
         self.db_path = db_path
+        self._pool = _get_pool(db_path)
+        self._car_cache: LRUCache[str, Car] = LRUCache(maxsize=CAR_CACHE_SIZE)
+        self._car_cache_lock = threading.Lock()
+        # Bumped on every write to a VIN so a read that raced a write doesn't
+        # cache the row it read before the write
+        self._car_generation: dict[str, int] = {}
+        self.car_cache_hits = 0
+        self.car_cache_misses = 0
         self._init_db()
 
-    @contextmanager
     def _get_connection(self):
-        conn = sqlite3.connect(self.db_path)
-        try:
-            yield conn
-        finally:
-            conn.close()
+        return self._pool.connection()
     
     def _init_db(self):
         with self._get_connection() as conn:
             cursor = conn.cursor()
 
+            # WAL lets readers and writers run concurrently; it has no
+            # meaning for an in-memory database
+            if self.db_path != ":memory:":
+                cursor.execute("PRAGMA journal_mode=WAL")
+
             # Vehicles table (updated)
             cursor.execute("""
                 CREATE TABLE IF NOT EXISTS cars(
@@ -61,12 +236,13 @@ class DatabaseDriver:
                     vehicle_vin TEXT,
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                     last_active TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    metadata TEXT,
+                    metadata BLOB,
                     FOREIGN KEY (vehicle_vin) REFERENCES cars(vin)
                 )
             """)
             
-            # Conversation history table
+            # Conversation history table. metadata holds orjson bytes; databases
+            # created with the old TEXT column read back the same way.
             cursor.execute("""
                 CREATE TABLE IF NOT EXISTS conversation_history (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -74,7 +250,7 @@ class DatabaseDriver:
                     role TEXT NOT NULL,
                     content TEXT NOT NULL,
                     timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    metadata TEXT,
+                    metadata BLOB,
                     FOREIGN KEY (session_id) REFERENCES sessions(session_id)
                 )
             """)
@@ -113,48 +289,114 @@ class DatabaseDriver:
                 )
             """)
             
-            conn.commit()
+            # Keep sessions.last_active current without a second statement per message
+            cursor.execute("""
+                CREATE TRIGGER IF NOT EXISTS trg_history_touch_session
+                AFTER INSERT ON conversation_history
+                BEGIN
+                    UPDATE sessions SET last_active = CURRENT_TIMESTAMP
+                    WHERE session_id = NEW.session_id;
+                END
+            """)
+            
+            # NHTSA responses (zlib-compressed JSON) so restarts skip the network
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS nhtsa_cache (
+                    key TEXT PRIMARY KEY,
+                    payload BLOB NOT NULL,
+                    fetched_at INTEGER NOT NULL
+                )
+            """)
+            cursor.execute(SQL_PRUNE_NHTSA_CACHE, (int(time.time() - NHTSA_CACHE_MAX_AGE),))
+            
+            # Indexes for the session, history and per-vehicle lookups
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_sessions_user
+                ON sessions(user_identifier, identifier_type, last_active DESC)
+            """)
+            # Covers SQL_GET_HISTORY's ORDER BY including the id tiebreak;
+            # replaces the earlier (session_id, timestamp DESC) index
+            cursor.execute("DROP INDEX IF EXISTS idx_history_session_ts")
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_history_session_ts_id
+                ON conversation_history(session_id, timestamp DESC, id DESC)
+            """)
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_service_vin ON service_history(vehicle_vin)")
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_appointments_vin_date
+                ON appointments(vehicle_vin, appointment_date)
+            """)
+            
+            # Refresh planner statistics so the indexes above get used
+            cursor.execute("ANALYZE")
     
     def create_car(self, vin: str, make: str, model: str, year: int, 
                    mileage: int = 0, owner_name: str = "", owner_phone: str = "") -> Car:
         with self._get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute(
-                """INSERT INTO cars (vin, make, model, year, mileage, owner_name, owner_phone) 
-                   VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                SQL_CREATE_CAR,
                 (vin, make, model, year, mileage, owner_name, owner_phone)
             )
-            conn.commit()
-            return Car(vin=vin, make=make, model=model, year=year, 
-                      mileage=mileage, owner_name=owner_name, owner_phone=owner_phone)
+        self._invalidate_car(vin)
+        return Car(vin=vin, make=make, model=model, year=year, 
+                  mileage=mileage, owner_name=owner_name, owner_phone=owner_phone)
+    
+    def get_cached_car(self, vin: str) -> Optional[Car]:
+        """Return the car only if it is already cached; never touches SQLite"""
+        with self._car_cache_lock:
+            car = self._car_cache.get(vin)
+            if car is not None:
+                self.car_cache_hits += 1
+            return car
     
     def get_car_by_vin(self, vin: str) -> Optional[Car]:
+        car = self.get_cached_car(vin)
+        if car is not None:
+            return car
+        
+        with self._car_cache_lock:
+            generation = self._car_generation.get(vin, 0)
+        
         with self._get_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute("SELECT vin, make, model, year, mileage, owner_name, owner_phone FROM cars WHERE vin = ?", (vin,))
-            row = cursor.fetchone()
-            if not row:
-                return None
-            
-            return Car(
-                vin=row[0],
-                make=row[1],
-                model=row[2],
-                year=row[3],
-                mileage=row[4] or 0,
-                owner_name=row[5] or "",
-                owner_phone=row[6] or ""
-            )
+            cursor.row_factory = _car_row
+            car = cursor.execute(SQL_GET_CAR, (vin,)).fetchone()
+        
+        with self._car_cache_lock:
+            self.car_cache_misses += 1
+            if car is not None and self._car_generation.get(vin, 0) == generation:
+                self._car_cache[vin] = car
+        return car
     
     def update_mileage(self, vin: str, mileage: int) -> bool:
         with self._get_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute(
-                "UPDATE cars SET mileage = ?, updated_at = ? WHERE vin = ?",
-                (mileage, datetime.now(), vin)
+            cursor.execute(SQL_UPDATE_MILEAGE, (mileage, vin))
+            updated = cursor.rowcount > 0
+        self._invalidate_car(vin)
+        return updated
+    
+    def _invalidate_car(self, vin: str):
+        with self._car_cache_lock:
+            self._car_cache.pop(vin, None)
+            self._car_generation[vin] = self._car_generation.get(vin, 0) + 1
+    
+    def get_nhtsa_cache(self, key: str, max_age: float):
+        """(payload, fetched_at) cached for key, or None if missing or older
+        than max_age seconds. fetched_at is a Unix timestamp."""
+        with self._get_connection() as conn:
+            row = conn.execute(SQL_GET_NHTSA_CACHE, (key, int(time.time() - max_age))).fetchone()
+        if not row:
+            return None
+        return orjson.loads(zlib.decompress(row[0])), row[1]
+    
+    def set_nhtsa_cache(self, key: str, payload):
+        with self._get_connection() as conn:
+            conn.execute(
+                SQL_SET_NHTSA_CACHE,
+                (key, zlib.compress(orjson.dumps(payload)), int(time.time()))
             )
-            conn.commit()
-            return cursor.rowcount > 0
 
 
 class SessionManager:
@@ -162,139 +404,83 @@ class SessionManager:
     
     def __init__(self, db_path: str = 'auto_db.sqlite'):
         self.db_path = db_path
-    
-    def _get_connection(self):
-        return sqlite3.connect(self.db_path)
+        self._pool = _get_pool(db_path)
     
     def create_session(self, user_identifier: str, identifier_type: str = "phone") -> str:
         """Create a new session or return existing one for the user"""
-        conn = self._get_connection()
-        cursor = conn.cursor()
-        
-        # Check if user has an existing active session
-        cursor.execute("""
-            SELECT session_id FROM sessions 
-            WHERE user_identifier = ? AND identifier_type = ?
-            ORDER BY last_active DESC LIMIT 1
-        """, (user_identifier, identifier_type))
-        
-        result = cursor.fetchone()
-        
-        if result:
-            session_id = result[0]
-            # Update last active time
-            cursor.execute("""
-                UPDATE sessions SET last_active = ? WHERE session_id = ?
-            """, (datetime.now(), session_id))
-        else:
-            # Create new session
-            session_id = str(uuid.uuid4())
-            cursor.execute("""
-                INSERT INTO sessions (session_id, user_identifier, identifier_type)
-                VALUES (?, ?, ?)
-            """, (session_id, user_identifier, identifier_type))
+        with self._pool.transaction() as conn:
+            cursor = conn.cursor()
+            
+            # Resume the user's most recent session if they have one. Both
+            # statements run inside BEGIN IMMEDIATE, so no other writer can
+            # slip in between them.
+            cursor.execute(SQL_FIND_SESSION, (user_identifier, identifier_type))
+            result = cursor.fetchone()
+            
+            if result:
+                session_id = result[0]
+                cursor.execute(SQL_TOUCH_SESSION, (session_id,))
+            else:
+                # Create new session
+                session_id = str(uuid.uuid4())
+                cursor.execute(SQL_CREATE_SESSION, (session_id, user_identifier, identifier_type))
         
-        conn.commit()
-        conn.close()
         return session_id
     
     def get_session(self, session_id: str) -> Optional[dict]:
         """Get session details"""
-        conn = self._get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            SELECT session_id, user_identifier, identifier_type, vehicle_vin, 
-                   created_at, last_active, metadata
-            FROM sessions WHERE session_id = ?
-        """, (session_id,))
+        key = (self.db_path, session_id)
+        with _SESSION_CACHE_LOCK:
+            session = _SESSION_CACHE.get(key)
+        if session is not None:
+            return dict(session)
         
-        result = cursor.fetchone()
-        conn.close()
+        with self._pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = _session_row
+            session = cursor.execute(SQL_GET_SESSION, (session_id,)).fetchone()
         
-        if result:
-            return {
-                "session_id": result[0],
-                "user_identifier": result[1],
-                "identifier_type": result[2],
-                "vehicle_vin": result[3],
-                "created_at": result[4],
-                "last_active": result[5],
-                "metadata": json.loads(result[6]) if result[6] else {}
-            }
+        if session:
+            with _SESSION_CACHE_LOCK:
+                _SESSION_CACHE[key] = session
+            return dict(session)
         return None
     
     def link_vehicle_to_session(self, session_id: str, vin: str):
         """Link a vehicle to the current session"""
-        conn = self._get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            UPDATE sessions SET vehicle_vin = ?, last_active = ?
-            WHERE session_id = ?
-        """, (vin, datetime.now(), session_id))
-        
-        conn.commit()
-        conn.close()
+        with self._pool.connection() as conn:
+            conn.execute(SQL_LINK_VEHICLE, (vin, session_id))
+        with _SESSION_CACHE_LOCK:
+            _SESSION_CACHE.pop((self.db_path, session_id), None)
     
     def add_message(self, session_id: str, role: str, content: str, metadata: dict = None):
         """Add a message to conversation history"""
-        conn = self._get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            INSERT INTO conversation_history (session_id, role, content, metadata)
-            VALUES (?, ?, ?, ?)
-        """, (session_id, role, content, json.dumps(metadata) if metadata else None))
-        
-        # Update session last active
-        cursor.execute("""
-            UPDATE sessions SET last_active = ? WHERE session_id = ?
-        """, (datetime.now(), session_id))
-        
-        conn.commit()
-        conn.close()
+        # trg_history_touch_session updates last_active in the same statement
+        with self._pool.connection() as conn:
+            conn.execute(SQL_ADD_MESSAGE, (session_id, role, content, orjson.dumps(metadata) if metadata else None))
+    
+    def add_messages_batch(self, session_id: str, messages: list):
+        """Add (role, content, metadata, timestamp) messages in a single transaction"""
+        with self._pool.transaction() as conn:
+            conn.executemany(SQL_ADD_MESSAGE_AT, [
+                (session_id, role, content, orjson.dumps(metadata) if metadata else None, timestamp)
+                for role, content, metadata, timestamp in messages
+            ])
     
     def get_conversation_history(self, session_id: str, limit: int = 20) -> list:
         """Get recent conversation history for a session"""
-        conn = self._get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            SELECT role, content, timestamp, metadata
-            FROM conversation_history
-            WHERE session_id = ?
-            ORDER BY timestamp DESC
-            LIMIT ?
-        """, (session_id, limit))
-        
-        results = cursor.fetchall()
-        conn.close()
-        
-        # Return in chronological order
-        history = []
-        for row in reversed(results):
-            history.append({
-                "role": row[0],
-                "content": row[1],
-                "timestamp": row[2],
-                "metadata": json.loads(row[3]) if row[3] else {}
-            })
-        return history
+        with self._pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = _history_row
+            # Rows are already in chronological order
+            return cursor.execute(SQL_GET_HISTORY, (session_id, limit)).fetchall()
     
     def get_session_by_user(self, user_identifier: str, identifier_type: str = "phone") -> Optional[dict]:
         """Find a session by user identifier (phone/email)"""
-        conn = self._get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            SELECT session_id FROM sessions 
-            WHERE user_identifier = ? AND identifier_type = ?
-            ORDER BY last_active DESC LIMIT 1
-        """, (user_identifier, identifier_type))
-        
-        result = cursor.fetchone()
-        conn.close()
+        with self._pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(SQL_FIND_SESSION, (user_identifier, identifier_type))
+            result = cursor.fetchone()
         
         if result:
             return self.get_session(result[0])
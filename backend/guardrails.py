@@ -1,8 +1,11 @@
+import logging
 import re
 from typing import Optional
 from dataclasses import dataclass
 from enum import Enum
 
+logger = logging.getLogger("guardrails")
+
 
 class GuardrailStatus(Enum):
     ALLOWED = "allowed"
@@ -18,7 +21,7 @@ class GuardrailResult:
 
 
 # Allowed topics for the auto service center
-ALLOWED_TOPICS = [
+ALLOWED_TOPICS = (
     "vehicle", "car", "truck", "suv", "van",
     "service", "repair", "maintenance", "oil change", "brake", "tire",
     "appointment", "schedule", "booking",
@@ -28,10 +31,10 @@ ALLOWED_TOPICS = [
     "engine", "transmission", "battery", "air filter",
     "hello", "hi", "hey", "thanks", "thank you", "bye", "goodbye",
     "help", "support", "speak", "agent", "human",
-]
+)
 
 # Blocked patterns (prompt injection attempts, off-topic)
-BLOCKED_PATTERNS = [
+BLOCKED_PATTERNS = (
     r"ignore.*instructions",
     r"forget.*previous",
     r"you are now",
@@ -43,45 +46,54 @@ BLOCKED_PATTERNS = [
     r"override",
     r"system prompt",
     r"ignore all",
-]
+)
 
 # Off-topic subjects to redirect
-OFF_TOPIC_SUBJECTS = [
+OFF_TOPIC_SUBJECTS = (
     "politics", "religion", "dating", "relationship",
     "medical advice", "legal advice", "investment",
     "cryptocurrency", "stocks", "gambling",
     "weapons", "drugs", "alcohol",
     "personal opinion", "controversial",
-]
+)
+
+
+def _compile_keywords(keywords) -> re.Pattern:
+    """One alternation matching any of the literal keywords as a substring"""
+    return re.compile("|".join(re.escape(k) for k in keywords))
 
 
 class TopicGuard:
     """Ensures conversation stays within auto service topics"""
     
+    # Each list compiled once into a single alternation: one scan per input
+    # instead of one re.search / substring test per entry
+    BLOCKED_RE = re.compile("|".join(f"(?:{p})" for p in BLOCKED_PATTERNS))
+    OFF_TOPIC_RE = _compile_keywords(OFF_TOPIC_SUBJECTS)
+    ALLOWED_RE = _compile_keywords(ALLOWED_TOPICS)
+    
     @staticmethod
     def check_topic(user_input: str) -> GuardrailResult:
         input_lower = user_input.lower()
         
         # Check for blocked patterns (prompt injection)
-        for pattern in BLOCKED_PATTERNS:
-            if re.search(pattern, input_lower):
-                return GuardrailResult(
-                    status=GuardrailStatus.BLOCKED,
-                    message="I'm here to help with auto service questions. How can I assist you with your vehicle today?",
-                    original_input=user_input
-                )
+        if TopicGuard.BLOCKED_RE.search(input_lower):
+            return GuardrailResult(
+                status=GuardrailStatus.BLOCKED,
+                message="I'm here to help with auto service questions. How can I assist you with your vehicle today?",
+                original_input=user_input
+            )
         
         # Check for off-topic subjects
-        for subject in OFF_TOPIC_SUBJECTS:
-            if subject in input_lower:
-                return GuardrailResult(
-                    status=GuardrailStatus.REDIRECTED,
-                    message=f"I specialize in auto service assistance. I can help you with vehicle repairs, maintenance, appointments, or parts. What can I help you with?",
-                    original_input=user_input
-                )
+        if TopicGuard.OFF_TOPIC_RE.search(input_lower):
+            return GuardrailResult(
+                status=GuardrailStatus.REDIRECTED,
+                message=f"I specialize in auto service assistance. I can help you with vehicle repairs, maintenance, appointments, or parts. What can I help you with?",
+                original_input=user_input
+            )
         
         # Check if any allowed topic is mentioned (loose matching for general queries)
-        has_allowed_topic = any(topic in input_lower for topic in ALLOWED_TOPICS)
+        has_allowed_topic = TopicGuard.ALLOWED_RE.search(input_lower) is not None
         
         # Allow general greetings and short messages
         if len(user_input.split()) <= 5 or has_allowed_topic:
@@ -103,8 +115,20 @@ class InputValidator:
     
     MAX_INPUT_LENGTH = 1000
     
+    # Leading/trailing whitespace, whitespace runs, or tabs/newlines: anything
+    # the sanitize step below would change
+    UNCLEAN_WHITESPACE_RE = re.compile(r"^\s|\s$|\s\s|[^\S ]")
+    
     @staticmethod
     def validate(user_input: str) -> GuardrailResult:
+        # Fast path: already-clean input passes through without a copy
+        if (user_input and len(user_input) <= InputValidator.MAX_INPUT_LENGTH
+                and not InputValidator.UNCLEAN_WHITESPACE_RE.search(user_input)):
+            return GuardrailResult(
+                status=GuardrailStatus.ALLOWED,
+                original_input=user_input
+            )
+        
         # Check for empty input
         if not user_input or not user_input.strip():
             return GuardrailResult(
@@ -134,32 +158,39 @@ class OutputFilter:
     """Validates AI responses before sending to user"""
     
     # Phrases the AI should never say
-    FORBIDDEN_PHRASES = [
+    FORBIDDEN_PHRASES = (
         "as an ai",
         "as a language model",
         "i cannot provide medical",
         "i cannot provide legal",
         "i'm just an ai",
         "my training data",
-    ]
+    )
     
     # Required context phrases for certain responses
     PRICE_DISCLAIMER = "Prices are estimates and may vary based on your specific vehicle and location."
+    PRICE_DISCLAIMER_LOWER = PRICE_DISCLAIMER.lower()
+    
+    # Mentions that trigger the price disclaimer
+    PRICE_KEYWORDS = ("price", "cost", "estimate", "$", "dollar")
+    
+    FORBIDDEN_RE = _compile_keywords(FORBIDDEN_PHRASES)
+    PRICE_RE = _compile_keywords(PRICE_KEYWORDS)
     
     @staticmethod
     def filter_response(response: str) -> str:
         response_lower = response.lower()
         
-        # Remove forbidden phrases by replacing with appropriate alternatives
-        for phrase in OutputFilter.FORBIDDEN_PHRASES:
-            if phrase in response_lower:
-                print(f"[OutputFilter] Removed forbidden phrase: {phrase}")
+        # Forbidden phrases are only reported, not rewritten, so don't scan
+        # for them unless the report would be emitted
+        if logger.isEnabledFor(logging.INFO):
+            for phrase in set(OutputFilter.FORBIDDEN_RE.findall(response_lower)):
+                logger.info("Forbidden phrase in response: %s", phrase)
         
         # Add disclaimer if discussing prices
-        price_keywords = ["price", "cost", "estimate", "$", "dollar"]
-        if any(kw in response_lower for kw in price_keywords):
-            if OutputFilter.PRICE_DISCLAIMER.lower() not in response_lower:
-                response += f"\n\n{OutputFilter.PRICE_DISCLAIMER}"
+        if (OutputFilter.PRICE_RE.search(response_lower)
+                and OutputFilter.PRICE_DISCLAIMER_LOWER not in response_lower):
+            response += f"\n\n{OutputFilter.PRICE_DISCLAIMER}"
         
         return response
 
@@ -167,30 +198,28 @@ class OutputFilter:
 class Guardrails:
     """Main guardrails interface combining all checks"""
     
-    def __init__(self):
-        self.topic_guard = TopicGuard()
-        self.input_validator = InputValidator()
-        self.output_filter = OutputFilter()
-    
     def check_input(self, user_input: str) -> GuardrailResult:
         """Run all input checks and return result"""
         
         # Step 1: Validate input
-        validation_result = self.input_validator.validate(user_input)
+        validation_result = InputValidator.validate(user_input)
         if validation_result.status != GuardrailStatus.ALLOWED:
             return validation_result
         
         # Step 2: Check topic boundaries
-        topic_result = self.topic_guard.check_topic(validation_result.original_input)
+        topic_result = TopicGuard.check_topic(validation_result.original_input)
         return topic_result
     
     def filter_output(self, response: str) -> str:
         """Filter AI response before sending to user"""
-        return self.output_filter.filter_response(response)
+        return OutputFilter.filter_response(response)
+
+
+# The checks hold no state, so one instance serves every caller
+GUARDRAILS = Guardrails()
 
 
 # Convenience function for quick checks
 def check_guardrails(user_input: str) -> GuardrailResult:
     """Quick guardrail check for user input"""
-    guardrails = Guardrails()
-    return guardrails.check_input(user_input)
+    return GUARDRAILS.check_input(user_input)
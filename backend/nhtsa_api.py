@@ -8,16 +8,160 @@ For a voice AI handling one customer at a time, this is appropriate usage.
 
 import aiohttp
 import asyncio
+import orjson
 import logging
+import re
+import time
+import urllib.parse
 from typing import Optional
-from dataclasses import dataclass
+from dataclasses import asdict, dataclass
+
+from cachetools import TLRUCache
 
 
 NHTSA_BASE_URL = "https://api.nhtsa.gov"
 VPIC_BASE_URL = "https://vpic.nhtsa.dot.gov/api"
 
+# Keep a slow NHTSA server from wedging the voice agent
+REQUEST_TIMEOUT = aiohttp.ClientTimeout(total=5, connect=2)
+
+# Sent with every request as session defaults
+REQUEST_HEADERS = {
+    "User-Agent": "Voice-AI-Agent/1.0 (+https://example.com/contact)",
+    "Accept": "application/json",
+}
+
+# One session per process so TCP/TLS connections are kept alive and reused
+_session: Optional[aiohttp.ClientSession] = None
+
+
+def _get_session() -> aiohttp.ClientSession:
+    """Return the shared HTTP session, creating it on first use"""
+    global _session
+    if _session is None or _session.closed:
+        _session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=32, ttl_dns_cache=300, keepalive_timeout=60),
+            headers=REQUEST_HEADERS,
+        )
+    return _session
+
+
+# 17 characters, no I, O or Q. Anything else is rejected before the request.
+_VIN_RE = re.compile(r"^[A-HJ-NPR-Z0-9]{17}$")
+
+
+# VIN decodes are effectively immutable; recall lists change on the order of
+# days. Fetchers return None for a failed lookup, which is never cached; an
+# empty recall list is a real answer and is.
+DECODE_TTL = 86400
+RECALL_TTL = 3600
+
+
+def _entry_expiry(key, entry, now):
+    return entry[1]
+
+
+# Entries are (value, monotonic expiry) so a row loaded from SQLite expires
+# when it would have, not a full TTL after the load
+_DECODE_CACHE: TLRUCache = TLRUCache(maxsize=4096, ttu=_entry_expiry)
+_RECALL_CACHE: TLRUCache = TLRUCache(maxsize=4096, ttu=_entry_expiry)
+# Per-key [lock, users] so concurrent misses for the same key make one
+# request; an entry is dropped once nobody holds or waits on its lock
+_DECODE_LOCKS: dict[str, list] = {}
+_RECALL_LOCKS: dict[tuple, list] = {}
+
+# Optional second tier below the in-memory caches that survives restarts;
+# anything with DatabaseDriver's get_nhtsa_cache / set_nhtsa_cache
+_persistent_cache = None
+# Coroutine function run(fn, *args) that runs blocking db calls off the loop
+_persistent_run = None
+
+
+async def _run_in_thread(fn, *args):
+    return await asyncio.to_thread(fn, *args)
+
+
+def set_persistent_cache(db, run=None):
+    """Back the NHTSA caches with db (None disables the persistent tier).
+    
+    run executes the blocking db calls, so callers can route them through
+    the same bounded executor as the rest of their DB work; defaults to
+    asyncio.to_thread.
+    """
+    global _persistent_cache, _persistent_run
+    _persistent_cache = db
+    _persistent_run = run or _run_in_thread
+
+
+async def _load_persisted(db_key: str, ttl: float, from_payload):
+    """(value, monotonic expiry) from the persistent tier, or None"""
+    db = _persistent_cache
+    if db is None:
+        return None
+    try:
+        row = await _persistent_run(db.get_nhtsa_cache, db_key, ttl)
+        if row is None:
+            return None
+        payload, fetched_at = row
+        return from_payload(payload), time.monotonic() + fetched_at + ttl - time.time()
+    except Exception as e:
+        logging.warning(f"[NHTSA] Persistent cache read failed: {e}")
+        return None
+
+
+async def _persist(db_key: str, payload):
+    db = _persistent_cache
+    if db is None:
+        return
+    try:
+        await _persistent_run(db.set_nhtsa_cache, db_key, payload)
+    except Exception as e:
+        logging.warning(f"[NHTSA] Persistent cache write failed: {e}")
+
 
-@dataclass
+def _recall_cache_key(make: str, model: str, year: int) -> tuple:
+    return (make.lower(), model.lower(), year)
+
+
+async def _cached(cache: TLRUCache, ttl: float, locks: dict, key, fetch,
+                  db_key: str, from_payload, to_payload):
+    """Read-through memory -> SQLite -> network with a per-key stampede guard"""
+    cached = cache.get(key)
+    if cached is not None:
+        return cached[0]
+    
+    entry = locks.get(key)
+    if entry is None:
+        entry = locks[key] = [asyncio.Lock(), 0]
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            cached = cache.get(key)
+            if cached is None:
+                cached = await _load_persisted(db_key, ttl, from_payload)
+                if cached is None:
+                    value = await fetch()
+                    if value is None:
+                        return None
+                    await _persist(db_key, to_payload(value))
+                    cached = (value, time.monotonic() + ttl)
+                cache[key] = cached
+    finally:
+        entry[1] -= 1
+        if entry[1] == 0:
+            del locks[key]
+    return cached[0]
+
+
+async def close_session():
+    """Close the shared HTTP session (call on shutdown)"""
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+
+
+@dataclass(slots=True)
 class RecallInfo:
     campaign_number: str
     component: str
@@ -28,7 +172,7 @@ class RecallInfo:
     report_date: str
 
 
-@dataclass
+@dataclass(slots=True)
 class VehicleInfo:
     make: str
     model: str
@@ -37,6 +181,21 @@ class VehicleInfo:
     plant_country: str
 
 
+# recallsByVehicle result keys and defaults, in RecallInfo field order
+_RECALL_KEYS = (
+    "NHTSACampaignNumber", "Component", "Summary", "Consequence",
+    "Remedy", "Manufacturer", "ReportReceivedDate",
+)
+_RECALL_DEFAULTS = ("N/A", "N/A", "No summary available", "N/A", "Contact dealer", "N/A", "N/A")
+
+# Spoken recall summaries are cut to this many characters
+SPOKEN_SUMMARY_LENGTH = 100
+
+
+def _truncate(text: str, limit: int) -> str:
+    return text if len(text) <= limit else text[:limit] + "..."
+
+
 class NHTSAApi:
     """Interface for NHTSA vehicle safety APIs"""
     
@@ -46,100 +205,109 @@ class NHTSAApi:
         # Clean the VIN
         vin = vin.upper().strip().replace(" ", "").replace("-", "")
         
-        if len(vin) != 17:
+        if not _VIN_RE.match(vin):
             return None
+        return await _cached(
+            _DECODE_CACHE, DECODE_TTL, _DECODE_LOCKS, vin,
+            lambda: NHTSAApi._fetch_vin(vin),
+            f"vin:{vin}",
+            lambda payload: VehicleInfo(**payload),
+            asdict,
+        )
+    
+    @staticmethod
+    async def _fetch_vin(vin: str) -> Optional[VehicleInfo]:
         # Use vPIC API for VIN decode
         url = f"{VPIC_BASE_URL}/vehicles/DecodeVinValues/{vin}?format=json"
-        headers = {
-            "User-Agent": "Voice-AI-Agent/1.0 (+https://example.com/contact)",
-            "Accept": "application/json",
-        }
-        
         try:
-            async with aiohttp.ClientSession(headers=headers) as session:
-                # Simple retry on 403/429
-                for attempt in range(2):
-                    try:
-                        async with session.get(url, timeout=aiohttp.ClientTimeout(total=10)) as response:
-                            if response.status in (403, 429):
-                                if attempt == 0:
-                                    await asyncio.sleep(0.5)
-                                    continue
-                                logging.warning(f"[vPIC] Decode VIN rate/forbidden status {response.status}")
-                                return None
-                            if response.status != 200:
-                                logging.warning(f"[vPIC] API returned status {response.status}")
-                                return None
-                            data = await response.json()
-                            results = data.get("Results", [])
-                            if not results:
-                                return None
-                            result = results[0]
-                            year_str = result.get("ModelYear", "0") or "0"
-                            try:
-                                year = int(year_str)
-                            except ValueError:
-                                year = 0
-                            return VehicleInfo(
-                                make=(result.get('Make') or 'Unknown').strip(),
-                                model=(result.get("Model") or "Unknown").strip(),
-                                year=year,
-                                vehicle_type=(result.get("VehicleType") or "Unknown").strip(),
-                                plant_country=(result.get("PlantCountry") or "Unknown").strip()
-                            )
-                    except aiohttp.ClientError as e:
-                        if attempt == 0:
-                            await asyncio.sleep(0.5)
-                            continue
-                        print(f"Network error: {e}")
-                        return None
+            session = _get_session()
+            # Simple retry on 403/429
+            for attempt in range(2):
+                try:
+                    async with session.get(url, timeout=REQUEST_TIMEOUT) as response:
+                        if response.status in (403, 429):
+                            if attempt == 0:
+                                await asyncio.sleep(0.5)
+                                continue
+                            logging.warning(f"[vPIC] Decode VIN rate/forbidden status {response.status}")
+                            return None
+                        if response.status != 200:
+                            logging.warning(f"[vPIC] API returned status {response.status}")
+                            return None
+                        data = await response.json(loads=orjson.loads)
+                        results = data.get("Results", [])
+                        if not results:
+                            return None
+                        result = results[0]
+                        year_str = result.get("ModelYear", "0") or "0"
+                        try:
+                            year = int(year_str)
+                        except ValueError:
+                            year = 0
+                        return VehicleInfo(
+                            make=(result.get('Make') or 'Unknown').strip(),
+                            model=(result.get("Model") or "Unknown").strip(),
+                            year=year,
+                            vehicle_type=(result.get("VehicleType") or "Unknown").strip(),
+                            plant_country=(result.get("PlantCountry") or "Unknown").strip()
+                        )
+                except aiohttp.ClientError as e:
+                    if attempt == 0:
+                        await asyncio.sleep(0.5)
+                        continue
+                    print(f"Network error: {e}")
+                    return None
         except Exception as e:
             print(f" Unexpected error: {e}")
             return None
     
+    @staticmethod
+    def has_cached_recalls(make: str, model: str, year: int) -> bool:
+        """True if recalls for this vehicle are already in the memory cache"""
+        return _recall_cache_key(make, model, year) in _RECALL_CACHE
+    
     @staticmethod
     async def get_recalls_by_vehicle(make: str, model: str, year: int) -> list[RecallInfo]:
         """Get recalls for a specific vehicle"""
+        key = _recall_cache_key(make, model, year)
+        recalls = await _cached(
+            _RECALL_CACHE, RECALL_TTL, _RECALL_LOCKS, key,
+            lambda: NHTSAApi._fetch_recalls(make, model, year),
+            "recalls:{}:{}:{}".format(*key),
+            lambda payload: [RecallInfo(**item) for item in payload],
+            lambda recalls: [asdict(recall) for recall in recalls],
+        )
+        return recalls if recalls is not None else []
+    
+    @staticmethod
+    async def _fetch_recalls(make: str, model: str, year: int) -> Optional[list[RecallInfo]]:
+        """Recalls from NHTSA; None if the request failed"""
         # URL encode the make and model
-        import urllib.parse
         make_encoded = urllib.parse.quote(make)
         model_encoded = urllib.parse.quote(model)
         
         url = f"{NHTSA_BASE_URL}/recalls/recallsByVehicle?make={make_encoded}&model={model_encoded}&modelYear={year}"
-        headers = {
-            "User-Agent": "Voice-AI-Agent/1.0 (+https://example.com/contact)",
-            "Accept": "application/json",
-        }
-        
         try:
-            async with aiohttp.ClientSession(headers=headers) as session:
-                async with session.get(url, timeout=aiohttp.ClientTimeout(total=10)) as response:
-                    if response.status != 200:
-                        logging.warning(f"[NHTSA] Recalls API returned status {response.status}")
-                        return []
-                    
-                    data = await response.json()
-                    results = data.get("results", [])
-                    
-                    recalls = []
-                    for item in results:
-                        recalls.append(RecallInfo(
-                            campaign_number=item.get("NHTSACampaignNumber", "N/A"),
-                            component=item.get("Component", "N/A"),
-                            summary=item.get("Summary", "No summary available"),
-                            consequence=item.get("Consequence", "N/A"),
-                            remedy=item.get("Remedy", "Contact dealer"),
-                            manufacturer=item.get("Manufacturer", "N/A"),
-                            report_date=item.get("ReportReceivedDate", "N/A")
-                        ))
-                    
-                    return recalls
+            session = _get_session()
+            async with session.get(url, timeout=REQUEST_TIMEOUT) as response:
+                if response.status != 200:
+                    logging.warning(f"[NHTSA] Recalls API returned status {response.status}")
+                    return None
+                
+                data = await response.json(loads=orjson.loads)
+                results = data.get("results", [])
+                
+                # map() drives the item.get(key, default) calls from C
+                return [
+                    RecallInfo(*map(item.get, _RECALL_KEYS, _RECALL_DEFAULTS))
+                    for item in results
+                ]
         except aiohttp.ClientError as e:
             logging.error(f"[NHTSA] Network error fetching recalls: {e}")
-            return []
+            return None
         except Exception as e:
             logging.error(f"[NHTSA] Unexpected error fetching recalls: {e}")
-            return []
+            return None
     
     
     @staticmethod
@@ -149,17 +317,17 @@ class NHTSAApi:
             return "Great news! I found no open recalls for your vehicle."
         
         count = len(recalls)
-        response = f"I found {count} recall{'s' if count > 1 else ''} for your vehicle. "
+        parts = [f"I found {count} recall{'s' if count > 1 else ''} for your vehicle. "]
         
         # Summarize first 3 recalls for voice
         for i, recall in enumerate(recalls[:3], 1):
-            summary = recall.summary[:100] + "..." if len(recall.summary) > 100 else recall.summary
-            response += f"Recall {i}: {recall.component}. {summary} "
+            summary = _truncate(recall.summary, SPOKEN_SUMMARY_LENGTH)
+            parts.append(f"Recall {i}: {recall.component}. {summary} ")
         
         if count > 3:
-            response += f"There are {count - 3} more recalls. Would you like me to provide more details?"
+            parts.append(f"There are {count - 3} more recalls. Would you like me to provide more details?")
         
-        return response
+        return "".join(parts)
     
     @staticmethod
     async def get_recalls_by_vin(vin: str) -> tuple[Optional[VehicleInfo], list[RecallInfo]]:
@@ -191,8 +359,8 @@ async def test_nhtsa():
         print('--> Example Recall Record  : \n', recalls[0])
     else:
         print(" Could not decode VIN (may be invalid or API unavailable)")
+    await close_session()
     
 
 if __name__ == "__main__":
-    import asyncio
     asyncio.run(test_nhtsa())
@@ -44,7 +44,8 @@ User: "Can you check if my car has any recalls?"
 You: "Absolutely! I can check that for you. What's your vehicle's VIN number? You can usually find it on your dashboard or driver's side door."
 """
 
-LOOKUP_VIN_MESSAGE = lambda msg: f"""The user said: "{msg.content if hasattr(msg, 'content') else msg}"
+# Filled with LOOKUP_VIN_MESSAGE.format(user_msg=...)
+LOOKUP_VIN_MESSAGE = """The user said: "{user_msg}"
 
 Extract any VIN number mentioned if present and use the lookup_car function. 
 If no VIN is clearly stated, ask the user to provide it.
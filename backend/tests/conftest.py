@@ -0,0 +1,10 @@
+import os
+import sys
+import tempfile
+
+# The backend modules import each other as top-level modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# api.py opens auto_db.sqlite in the working directory at import time; keep
+# that out of the source tree
+os.chdir(tempfile.mkdtemp(prefix="voice-agent-tests-"))
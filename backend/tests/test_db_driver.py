@@ -0,0 +1,204 @@
+import sqlite3
+import time
+from contextlib import contextmanager
+
+import pytest
+
+import db_driver
+from db_driver import DatabaseDriver, SessionManager
+
+VIN = "1FA6P8CF0F5391308"
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / "test.sqlite")
+    DatabaseDriver(path)  # creates the schema
+    return path
+
+
+@pytest.fixture
+def sessions(db_path):
+    return SessionManager(db_path)
+
+
+def test_create_session_resumes_latest(sessions):
+    session_id = sessions.create_session("555-0100")
+    
+    assert sessions.create_session("555-0100") == session_id
+    assert sessions.create_session("555-0100", "email") != session_id
+    assert sessions.create_session("555-0199") != session_id
+    assert sessions.get_session_by_user("555-0100")["session_id"] == session_id
+
+
+def test_get_session(sessions):
+    session_id = sessions.create_session("555-0100")
+    sessions.link_vehicle_to_session(session_id, VIN)
+    
+    session = sessions.get_session(session_id)
+    assert session["session_id"] == session_id
+    assert session["user_identifier"] == "555-0100"
+    assert session["identifier_type"] == "phone"
+    assert session["vehicle_vin"] == VIN
+    assert session["metadata"] == {}
+    assert sessions.get_session("missing") is None
+
+
+def test_history_round_trip(sessions):
+    session_id = sessions.create_session("555-0100")
+    sessions.add_message(session_id, "user", "hello", {"turn": 1})
+    sessions.add_messages_batch(session_id, [
+        ("assistant", "hi there", None, "2999-01-01 00:00:00"),
+        ("user", "bye", {"turn": 2}, "2999-01-01 00:00:01"),
+    ])
+    
+    history = sessions.get_conversation_history(session_id)
+    assert [(m["role"], m["content"], m["metadata"]) for m in history] == [
+        ("user", "hello", {"turn": 1}),
+        ("assistant", "hi there", {}),
+        ("user", "bye", {"turn": 2}),
+    ]
+    assert [m["content"] for m in sessions.get_conversation_history(session_id, limit=2)] == ["hi there", "bye"]
+
+
+def test_history_same_second_keeps_insert_order(sessions):
+    session_id = sessions.create_session("555-0100")
+    sessions.add_messages_batch(session_id, [
+        (role, content, None, "2999-01-01 00:00:00")
+        for role, content in [("user", "one"), ("assistant", "two"), ("user", "three")]
+    ])
+    
+    history = sessions.get_conversation_history(session_id)
+    assert [m["content"] for m in history] == ["one", "two", "three"]
+    assert [m["content"] for m in sessions.get_conversation_history(session_id, limit=2)] == ["two", "three"]
+
+
+def test_failed_batch_leaves_no_rows(db_path, sessions):
+    session_id = sessions.create_session("555-0100")
+    
+    with pytest.raises(sqlite3.IntegrityError):
+        # content is NOT NULL, so the second row fails after the first was inserted
+        sessions.add_messages_batch(session_id, [
+            ("user", "kept?", None, "2999-01-01 00:00:00"),
+            ("user", None, None, "2999-01-01 00:00:01"),
+        ])
+    
+    assert sessions.get_conversation_history(session_id) == []
+    # The connection went back to the pool outside a transaction
+    with db_driver._get_pool(db_path).connection() as conn:
+        assert not conn.in_transaction
+
+
+def test_transaction_rolls_back_on_error(db_path):
+    pool = db_driver._get_pool(db_path)
+    
+    with pytest.raises(RuntimeError):
+        with pool.transaction() as conn:
+            conn.execute(
+                "INSERT INTO sessions (session_id, user_identifier, identifier_type) VALUES ('s', 'u', 'phone')"
+            )
+            raise RuntimeError("boom")
+    
+    with pool.connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0] == 0
+
+
+def test_pool_reuses_connections(db_path):
+    pool = db_driver._get_pool(db_path)
+    assert db_driver._get_pool(db_path) is pool
+    
+    with pool.connection() as first:
+        pass
+    with pool.connection() as second:
+        assert second is first
+
+
+def test_car_crud(db_path):
+    db = DatabaseDriver(db_path)
+    assert db.get_car_by_vin(VIN) is None
+    
+    db.create_car(VIN, "Ford", "Mustang", 2015, 1200, "Alex", "555-0100")
+    car = db.get_car_by_vin(VIN)
+    assert (car.make, car.model, car.year, car.mileage, car.owner_name) == ("Ford", "Mustang", 2015, 1200, "Alex")
+    
+    assert db.update_mileage(VIN, 1500)
+    assert db.get_car_by_vin(VIN).mileage == 1500
+    assert not db.update_mileage("00000000000000000", 10)
+
+
+def test_memory_database_is_shared():
+    # Each ':memory:' connection is its own database, so the pool keeps one
+    DatabaseDriver(":memory:")
+    sessions = SessionManager(":memory:")
+    session_id = sessions.create_session("555-0100")
+    assert sessions.get_session(session_id)["session_id"] == session_id
+
+
+def _set_last_active(db_path, session_id, value):
+    conn = sqlite3.connect(db_path)
+    with conn:
+        conn.execute("UPDATE sessions SET last_active = ? WHERE session_id = ?", (value, session_id))
+    conn.close()
+
+
+def test_add_message_bumps_last_active(db_path, sessions):
+    session_id = sessions.create_session("555-0100")
+    _set_last_active(db_path, session_id, "2000-01-01 00:00:00")
+    
+    sessions.add_message(session_id, "user", "hello")
+    assert sessions.get_session(session_id)["last_active"] > "2000-01-01 00:00:00"
+
+
+def test_resume_bumps_last_active(db_path, sessions):
+    session_id = sessions.create_session("555-0100")
+    _set_last_active(db_path, session_id, "2000-01-01 00:00:00")
+    
+    assert sessions.create_session("555-0100") == session_id
+    assert sessions.get_session(session_id)["last_active"] > "2000-01-01 00:00:00"
+
+
+def test_car_cache_skips_rows_read_before_a_write(db_path, monkeypatch):
+    db = DatabaseDriver(db_path)
+    db.create_car(VIN, "Ford", "Mustang", 2015, 1200, "Alex")
+    read_connection = db._get_connection
+    
+    @contextmanager
+    def read_then_update():
+        # The mileage update commits after the SELECT but before the reader
+        # would populate the cache
+        with read_connection() as conn:
+            yield conn
+        monkeypatch.setattr(db, "_get_connection", read_connection)
+        db.update_mileage(VIN, 1500)
+    
+    monkeypatch.setattr(db, "_get_connection", read_then_update)
+    assert db.get_car_by_vin(VIN).mileage == 1200
+    
+    assert db.get_cached_car(VIN) is None
+    assert db.get_car_by_vin(VIN).mileage == 1500
+
+
+def test_nhtsa_cache_round_trip(db_path):
+    db = DatabaseDriver(db_path)
+    db.set_nhtsa_cache("vin:" + VIN, {"make": "Ford"})
+    
+    payload, fetched_at = db.get_nhtsa_cache("vin:" + VIN, 60)
+    assert payload == {"make": "Ford"}
+    assert abs(fetched_at - time.time()) < 5
+    assert db.get_nhtsa_cache("vin:missing", 60) is None
+
+
+def test_stale_nhtsa_rows_pruned_at_startup(db_path, monkeypatch):
+    db = DatabaseDriver(db_path)
+    stale = time.time() - db_driver.NHTSA_CACHE_MAX_AGE - 60
+    with monkeypatch.context() as m:
+        m.setattr(time, "time", lambda: stale)
+        db.set_nhtsa_cache("vin:old", {})
+    db.set_nhtsa_cache("vin:new", {})
+    
+    DatabaseDriver(db_path)
+    conn = sqlite3.connect(db_path)
+    try:
+        assert conn.execute("SELECT key FROM nhtsa_cache").fetchall() == [("vin:new",)]
+    finally:
+        conn.close()
@@ -0,0 +1,77 @@
+import asyncio
+import time
+from dataclasses import asdict
+
+import pytest
+
+import nhtsa_api
+from db_driver import DatabaseDriver
+from nhtsa_api import NHTSAApi, VehicleInfo
+
+VIN = "1FA6P8CF0F5391308"
+MUSTANG = VehicleInfo("Ford", "Mustang", 2015, "PASSENGER CAR", "UNITED STATES (USA)")
+
+
+@pytest.fixture
+def decodes(monkeypatch):
+    """Stub the vPIC request, counting calls, and start from empty caches"""
+    calls = []
+    
+    async def fetch_vin(vin):
+        calls.append(vin)
+        await asyncio.sleep(0.01)
+        return MUSTANG
+    
+    monkeypatch.setattr(NHTSAApi, "_fetch_vin", staticmethod(fetch_vin))
+    monkeypatch.setattr(nhtsa_api, "_persistent_cache", None)
+    nhtsa_api._DECODE_CACHE.clear()
+    return calls
+
+
+def test_concurrent_decodes_share_one_request(decodes):
+    async def main():
+        return await asyncio.gather(*(NHTSAApi.decode_vin(VIN) for _ in range(10)))
+    
+    assert asyncio.run(main()) == [MUSTANG] * 10
+    assert decodes == [VIN]
+    # Nobody holds or waits on the key any more
+    assert nhtsa_api._DECODE_LOCKS == {}
+
+
+def test_invalid_vin_skips_request(decodes):
+    assert asyncio.run(NHTSAApi.decode_vin("1FA6P8CFOF5391308")) is None
+    assert decodes == []
+
+
+def test_persistent_cache_uses_given_runner(decodes, monkeypatch, tmp_path):
+    ran = []
+    
+    async def run(fn, *args):
+        ran.append(fn.__name__)
+        return fn(*args)
+    
+    monkeypatch.setattr(nhtsa_api, "_persistent_run", None)
+    nhtsa_api.set_persistent_cache(DatabaseDriver(str(tmp_path / "test.sqlite")), run)
+    
+    assert asyncio.run(NHTSAApi.decode_vin(VIN)) == MUSTANG
+    
+    # A restart loses the memory tier but not SQLite
+    nhtsa_api._DECODE_CACHE.clear()
+    assert asyncio.run(NHTSAApi.decode_vin(VIN)) == MUSTANG
+    assert decodes == [VIN]
+    assert ran == ["get_nhtsa_cache", "set_nhtsa_cache", "get_nhtsa_cache"]
+
+
+def test_persisted_decode_keeps_its_age(decodes, monkeypatch, tmp_path):
+    db = DatabaseDriver(str(tmp_path / "test.sqlite"))
+    fetched_at = time.time() - nhtsa_api.DECODE_TTL + 60
+    with monkeypatch.context() as m:
+        m.setattr(time, "time", lambda: fetched_at)
+        db.set_nhtsa_cache(f"vin:{VIN}", asdict(MUSTANG))
+    monkeypatch.setattr(nhtsa_api, "_persistent_run", None)
+    nhtsa_api.set_persistent_cache(db)
+    
+    assert asyncio.run(NHTSAApi.decode_vin(VIN)) == MUSTANG
+    assert decodes == []
+    # The memory copy expires with the row, about a minute from now
+    assert nhtsa_api._DECODE_CACHE[VIN][1] - time.monotonic() < 120